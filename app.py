@@ -1,7 +1,20 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import plotly.express as px
+import pyarrow as pa
+import pyarrow.parquet as pq
 import os
+import io
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+# Prefer the Rust-based Calamine parser, fall back to openpyxl if it is not installed
+try:
+    import python_calamine  # noqa: F401
+    EXCEL_ENGINE = "calamine"
+except ImportError:
+    EXCEL_ENGINE = "openpyxl"
 
 # -------------------------------
 # File path
@@ -12,16 +25,96 @@ if not os.path.exists(file_path):
     st.error(f"Excel file not found at {file_path}. Please check the file name!")
     st.stop()  # Stops Streamlit execution if file missing
 
+# -------------------------------
+# Columns kept after load (everything the UI and the download use)
+# -------------------------------
+MAIN_COLS = (
+    "Company_symbol", "Company_name", "quarter_date", "InstitutionShareHeld",
+    "InstitutionPercentHeld", "Institutionholdernumber", "InstitutionSharesBought",
+    "InstitutionSharesSold", "Total_SharesOutstanding", "Sharefloat", "industry",
+    "quarter_date_str", "NetSharesChange", "PercentChangeHeld", "InstitutionOwnershipValue"
+)
+INST_COLS = (
+    "owner_name", "Company_symbol", "total_market_value", "total_shares",
+    "share_change", "share_change_percentage"
+)
+
+# -------------------------------
+# Parquet Cache (one file per sheet, rebuilt when the Excel file changes)
+# -------------------------------
+SOURCE_MTIME_KEY = b"source_xlsx_mtime_ns"  # Parquet schema metadata: mtime of the xlsx it came from
+
+def _parquet_source_mtime(parquet_path):
+    # Reads only the file footer; a missing or unreadable file counts as stale
+    try:
+        metadata = pq.read_schema(parquet_path).metadata or {}
+    except (OSError, pa.ArrowInvalid):
+        return None
+    return metadata.get(SOURCE_MTIME_KEY)
+
+def _ensure_parquet(xlsx_path):
+    base = os.path.splitext(xlsx_path)[0]
+    parquet_paths = {
+        "Sheet1": f"{base}.sheet1.parquet",
+        "Institution_Holdings": f"{base}.inst.parquet",
+    }
+
+    # Rebuild on any mtime change, not only a newer one: a workbook copied in with its
+    # original mtime preserved (rsync -a, cp -p, archives) can predate the cache
+    xlsx_mtime = str(os.stat(xlsx_path).st_mtime_ns).encode()
+    stale_sheets = [
+        sheet_name for sheet_name, parquet_path in parquet_paths.items()
+        if _parquet_source_mtime(parquet_path) != xlsx_mtime
+    ]
+    if not stale_sheets:
+        return parquet_paths
+
+    # Open the workbook once and parse every stale sheet from the same handle
+    with pd.ExcelFile(xlsx_path, engine=EXCEL_ENGINE) as book:
+        for sheet_name in stale_sheets:
+            sheet_df = book.parse(sheet_name)
+            # Write to a uniquely named temp file first so concurrent processes never
+            # interleave writes or read a partial file
+            parquet_path = parquet_paths[sheet_name]
+            fd, tmp_path = tempfile.mkstemp(
+                dir=os.path.dirname(parquet_path) or ".",
+                prefix=os.path.basename(parquet_path) + ".", suffix=".tmp"
+            )
+            os.close(fd)
+            try:
+                table = pa.Table.from_pandas(sheet_df, preserve_index=False)
+                table = table.replace_schema_metadata(
+                    {**(table.schema.metadata or {}), SOURCE_MTIME_KEY: xlsx_mtime}
+                )
+                pq.write_table(table, tmp_path, compression="zstd")
+                # mkstemp creates the file as 0600; give it normal umask-based permissions
+                # so a cache built by one user stays readable by others
+                mask = os.umask(0)
+                os.umask(mask)
+                os.chmod(tmp_path, 0o666 & ~mask)
+                os.replace(tmp_path, parquet_path)
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+
+    return parquet_paths
+
 # -------------------------------
 # Load Data (Main Ownership Data)
 # -------------------------------
-@st.cache_data
 def load_data(file_path):
-    df = pd.read_excel(file_path, sheet_name="Sheet1")
+    df = pd.read_parquet(_ensure_parquet(file_path)["Sheet1"])
 
     # Ensure quarter_date is datetime
     df["quarter_date"] = pd.to_datetime(df["quarter_date"], errors="coerce")
-    df["quarter_date_str"] = df["quarter_date"].dt.strftime("%b %Y")  
+    # Format each distinct date once; labels are stored as a categorical in date order
+    date_codes, quarter_dates = pd.factorize(df["quarter_date"], sort=True)
+    label_codes, quarter_labels = pd.factorize(quarter_dates.strftime("%b %Y"))
+    df["quarter_date_str"] = pd.Categorical.from_codes(
+        # Trailing -1 sentinel: NaT (code -1) maps to a missing label, even when every
+        # date is NaT and label_codes is empty
+        np.append(label_codes, -1)[date_codes], categories=quarter_labels
+    )
 
     # Calculated Fields
     df["NetSharesChange"] = df["InstitutionSharesBought"] - df["InstitutionSharesSold"]
@@ -31,27 +124,137 @@ def load_data(file_path):
     if "InstitutionShareHeld" not in df.columns:
         df["InstitutionShareHeld"] = (df["InstitutionPercentHeld"] / 100) * df["Total_SharesOutstanding"]
 
+    df = df.drop(columns=df.columns.difference(MAIN_COLS))
+
+    # Narrow dtypes. Share counts reach tens of billions, so they are only downcast
+    # losslessly (to_numeric keeps int64 where needed). InstitutionPercentHeld stays
+    # float64 because float32 shows rounding noise in the tables and the download.
+    count_cols = [
+        "InstitutionShareHeld", "Institutionholdernumber", "InstitutionSharesBought",
+        "InstitutionSharesSold", "Total_SharesOutstanding", "Sharefloat", "NetSharesChange"
+    ]
+    for col in count_cols:
+        df[col] = pd.to_numeric(df[col], downcast="integer")
+    df["PercentChangeHeld"] = pd.to_numeric(df["PercentChangeHeld"], downcast="float")
+
+    # Low-cardinality keys as categoricals: filters and groupbys work on integer codes
+    for col in ["Company_symbol", "Company_name", "industry"]:
+        df[col] = df[col].astype("category")
+
+    # Sort once so each company is a contiguous, chronologically ordered block
+    df = df.sort_values(["Company_symbol", "quarter_date"], ignore_index=True)
+
     return df
 
 # -------------------------------
 # Load Institution Holdings Data (New Sheet)
 # -------------------------------
-@st.cache_data
 def load_institution_data(file_path):
-    inst_df = pd.read_excel(file_path, sheet_name="Institution_Holdings")
+    inst_df = pd.read_parquet(_ensure_parquet(file_path)["Institution_Holdings"])
+    inst_df = inst_df.drop(columns=inst_df.columns.difference(INST_COLS))
 
     numeric_cols = ["total_market_value", "total_shares", "share_change", "share_change_percentage"]
     for col in numeric_cols:
         if col in inst_df.columns:
             inst_df[col] = pd.to_numeric(inst_df[col], errors="coerce").fillna(0)
+            inst_df[col] = pd.to_numeric(inst_df[col], downcast="integer")
+
+    inst_df["Company_symbol"] = inst_df["Company_symbol"].astype("category")
 
     return inst_df
 
+# -------------------------------
+# Load Both Sheets (in parallel, once per process)
+# -------------------------------
+@st.cache_resource(max_entries=1)
+def load_all_data(file_path, data_version):
+    """Shared across sessions without copying: treat the returned frames as read-only."""
+    # data_version (Excel mtime) is part of the key, so a replaced workbook is reloaded
+    # and the frames of the previous version are evicted
+    # Convert stale sheets up front so the two readers never race on the Parquet files
+    _ensure_parquet(file_path)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        main_future = executor.submit(load_data, file_path)
+        inst_future = executor.submit(load_institution_data, file_path)
+        return main_future.result(), inst_future.result()
+
 # -------------------------------
 # Helper
 # -------------------------------
+METRIC_COLS = (
+    "InstitutionPercentHeld", "InstitutionShareHeld", "Institutionholdernumber",
+    "InstitutionSharesBought", "InstitutionSharesSold", "Sharefloat", "Total_SharesOutstanding"
+)
+
 def to_million(x):
-    return round(x / 1_000_000, 2)
+    # np.round so scalars, Series and arrays all work
+    return np.round(x / 1_000_000, 2)
+
+MAX_CHART_POINTS = 2000
+
+def downsample(frame, y_col, max_points=MAX_CHART_POINTS):
+    # Largest-Triangle-Three-Buckets decimation of a time-ordered frame before plotting
+    n = len(frame)
+    if n <= max_points or max_points < 3:
+        return frame
+
+    x = np.arange(n, dtype="float64")
+    y = frame[y_col].to_numpy(dtype="float64")
+    edges = np.linspace(1, n - 1, max_points - 1).astype(int)
+
+    keep = [0]
+    a = 0
+    for i in range(max_points - 2):
+        lo, hi = edges[i], edges[i + 1]
+        next_hi = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x, avg_y = x[hi:next_hi].mean(), y[hi:next_hi].mean()
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(np.argmax(area))
+        keep.append(a)
+    keep.append(n - 1)
+
+    return frame.iloc[keep]
+
+# -------------------------------
+# Download Export (built once per data version, not on every rerun)
+# -------------------------------
+@st.cache_data
+def build_download_bytes(_df, data_version, file_format):
+    # _df is not hashed by Streamlit; data_version (Excel mtime) is the cache key
+    if file_format == "csv":
+        return _df.to_csv(index=False).encode("utf-8")
+    buf = io.BytesIO()
+    _df.to_parquet(buf, index=False, compression="zstd")
+    return buf.getvalue()
+
+# -------------------------------
+# Derived Views (independent of filters, cached per data version)
+# -------------------------------
+@st.cache_data
+def latest_per_company(_df, data_version):
+    return _df.loc[_df.groupby("Company_symbol", observed=True, sort=False)["quarter_date"].idxmax()].reset_index(drop=True)
+
+@st.cache_resource
+def industry_index(_df, data_version):
+    # industry -> row positions of its companies in latest_per_company()
+    latest_df = latest_per_company(_df, data_version)
+    return latest_df.groupby("industry", observed=True, sort=False).indices
+
+@st.cache_data
+def company_slices(_df, data_version):
+    # Row range of each company in the sorted frame; missing symbols sort last (code -1)
+    codes = _df["Company_symbol"].cat.codes.to_numpy()
+    codes = codes[:np.count_nonzero(codes >= 0)]
+    categories = _df["Company_symbol"].cat.categories
+    starts = np.searchsorted(codes, np.arange(len(categories)), side="left")
+    ends = np.searchsorted(codes, np.arange(len(categories)), side="right")
+    return {symbol: (int(start), int(end)) for symbol, start, end in zip(categories, starts, ends)}
+
+@st.cache_data
+def filter_view(_df, data_version, company, quarters):
+    start, end = company_slices(_df, data_version).get(company, (0, 0))
+    company_df = _df.iloc[start:end]
+    return company_df[company_df["quarter_date_str"].isin(quarters)]
 
 # -------------------------------
 # Main App
@@ -65,16 +268,16 @@ def main():
     # Sidebar Filters
     # -------------------------------
     st.sidebar.header("🔎 Filters")
-    df = load_data(file_path)
-    inst_df = load_institution_data(file_path)
+    data_version = os.path.getmtime(file_path)
+    df, inst_df = load_all_data(file_path, data_version)
 
     company_list = df["Company_symbol"].unique()
     company = st.sidebar.selectbox("Select Company", company_list)
 
-    filtered_df = df[df["Company_symbol"] == company].sort_values("quarter_date")
-    quarter_list = filtered_df["quarter_date_str"].unique()
+    start, end = company_slices(df, data_version).get(company, (0, 0))
+    quarter_list = df["quarter_date_str"].iloc[start:end].unique()
     selected_quarters = st.sidebar.multiselect("Select Quarters", quarter_list, default=quarter_list)
-    filtered_df = filtered_df[filtered_df["quarter_date_str"].isin(selected_quarters)]
+    filtered_df = filter_view(df, data_version, company, tuple(selected_quarters))
 
     if filtered_df.empty:
         st.warning("⚠️ No data available for selected filters.")
@@ -83,35 +286,44 @@ def main():
     # -------------------------------
     # Summary Metrics
     # -------------------------------
-    latest = filtered_df.iloc[-1]
-    first = filtered_df.iloc[0]
+    # Metrics only need the first and last rows: gather them into one float64 block
+    # so every change and million-conversion below is a single vectorized op
+    endpoints = np.array(
+        [filtered_df[col].to_numpy()[[0, -1]] for col in METRIC_COLS], dtype="float64"
+    ).T
+    first_vals, latest_vals = endpoints
+    latest = dict(zip(METRIC_COLS, latest_vals))
+    change = dict(zip(METRIC_COLS, latest_vals - first_vals))
+    latest_m = dict(zip(METRIC_COLS, to_million(latest_vals)))
+    change_m = dict(zip(METRIC_COLS, to_million(latest_vals - first_vals)))
+    latest_industry = filtered_df["industry"].iat[-1]
 
     st.markdown("### 📌 Key Metrics (Latest Quarter)")
     c1, c2, c3, c4 = st.columns(4)
     c5, c6, c7, c8 = st.columns(4)
 
     c1.metric("Institution % Held", f"{latest['InstitutionPercentHeld']:.2f}%")
-    c2.metric("Institution Shares Held (M)", f"{to_million(latest['InstitutionShareHeld']):,}M")
-    c3.metric("Net Share Change (M)", f"{to_million(latest['InstitutionShareHeld'] - first['InstitutionShareHeld']):+,.2f}M")
-    c4.metric("Institution Holders", f"{latest['Institutionholdernumber']:,}")
+    c2.metric("Institution Shares Held (M)", f"{latest_m['InstitutionShareHeld']:,}M")
+    c3.metric("Net Share Change (M)", f"{change_m['InstitutionShareHeld']:+,.2f}M")
+    c4.metric("Institution Holders", f"{int(latest['Institutionholdernumber']):,}")
 
-    c5.metric("Shares Bought (Q) (M)", f"{to_million(latest['InstitutionSharesBought']):,}M")
-    c6.metric("Shares Sold (Q) (M)", f"{to_million(latest['InstitutionSharesSold']):,}M")
-    c7.metric("Share Float (M)", f"{to_million(latest['Sharefloat']):,}M")
-    c8.metric("Shares Outstanding (M)", f"{to_million(latest['Total_SharesOutstanding']):,}M")
+    c5.metric("Shares Bought (Q) (M)", f"{latest_m['InstitutionSharesBought']:,}M")
+    c6.metric("Shares Sold (Q) (M)", f"{latest_m['InstitutionSharesSold']:,}M")
+    c7.metric("Share Float (M)", f"{latest_m['Sharefloat']:,}M")
+    c8.metric("Shares Outstanding (M)", f"{latest_m['Total_SharesOutstanding']:,}M")
 
     st.markdown("### 📈 Change Between Selected Quarters")
     d1, d2, d3, d4 = st.columns(4)
     d5, d6, d7 = st.columns(3)
 
-    d1.metric("Change in % Held", f"{(latest['InstitutionPercentHeld'] - first['InstitutionPercentHeld']):+.2f}%")
-    d2.metric("Change in Shares Held (M)", f"{to_million(latest['InstitutionShareHeld'] - first['InstitutionShareHeld']):+,.2f}M")
-    d3.metric("Change in Holders", f"{latest['Institutionholdernumber'] - first['Institutionholdernumber']:+,}")
-    d4.metric("Change in Shares Bought (M)", f"{to_million(latest['InstitutionSharesBought'] - first['InstitutionSharesBought']):+,.2f}M")
+    d1.metric("Change in % Held", f"{change['InstitutionPercentHeld']:+.2f}%")
+    d2.metric("Change in Shares Held (M)", f"{change_m['InstitutionShareHeld']:+,.2f}M")
+    d3.metric("Change in Holders", f"{int(change['Institutionholdernumber']):+,}")
+    d4.metric("Change in Shares Bought (M)", f"{change_m['InstitutionSharesBought']:+,.2f}M")
 
-    d5.metric("Change in Shares Sold (M)", f"{to_million(latest['InstitutionSharesSold'] - first['InstitutionSharesSold']):+,.2f}M")
-    d6.metric("Change in Float (M)", f"{to_million(latest['Sharefloat'] - first['Sharefloat']):+,.2f}M")
-    d7.metric("Change in Shares Outstanding (M)", f"{to_million(latest['Total_SharesOutstanding'] - first['Total_SharesOutstanding']):+,.2f}M")
+    d5.metric("Change in Shares Sold (M)", f"{change_m['InstitutionSharesSold']:+,.2f}M")
+    d6.metric("Change in Float (M)", f"{change_m['Sharefloat']:+,.2f}M")
+    d7.metric("Change in Shares Outstanding (M)", f"{change_m['Total_SharesOutstanding']:+,.2f}M")
 
     st.markdown("---")
 
@@ -127,12 +339,8 @@ def main():
 
     # Ownership Trend
     with tab1:
-        filtered_df["OwnershipCombined"] = (
-            filtered_df["InstitutionPercentHeld"].map(lambda x: f"{x:.2f}%") + " | " +
-            filtered_df["InstitutionShareHeld"].map(lambda x: f"{to_million(x):,}M Shares")
-        )
         fig_main = px.line(
-            filtered_df, x="quarter_date_str", y="InstitutionPercentHeld",
+            downsample(filtered_df, "InstitutionPercentHeld"), x="quarter_date_str", y="InstitutionPercentHeld",
             markers=True, title="Institution Ownership Over Time",
             labels={"quarter_date_str": "Quarter", "InstitutionPercentHeld": "% Held"},
             line_shape="spline", template="plotly_dark", height=500
@@ -144,8 +352,11 @@ def main():
         col1, col2 = st.columns([2, 1])
         with col1:
             filtered_df['NetChangeDiff'] = filtered_df['NetSharesChange'].diff().fillna(0)
+            # Plotly (>= 6.0) ships numeric arrays as base64 typed arrays, except int64 values
+            # outside the int32 range, which fall back to JSON lists; float64 keeps them binary
+            net_df = downsample(filtered_df, "NetSharesChange").astype({"NetSharesChange": "float64"})
             fig_net = px.bar(
-                filtered_df, x="quarter_date_str", y="NetSharesChange",
+                net_df, x="quarter_date_str", y="NetSharesChange",
                 title="Net Shares Change per Quarter", color="NetSharesChange",
                 color_continuous_scale=px.colors.sequential.Viridis,
                 template="plotly_dark", height=400
@@ -153,7 +364,7 @@ def main():
             st.plotly_chart(fig_net, use_container_width=True)
         with col2:
             fig_holders = px.line(
-                filtered_df, x="quarter_date_str", y="Institutionholdernumber",
+                downsample(filtered_df, "Institutionholdernumber"), x="quarter_date_str", y="Institutionholdernumber",
                 markers=True, title="Institution Holder Count Over Time",
                 labels={"quarter_date_str": "Quarter", "Institutionholdernumber": "Count"},
                 line_shape="spline", template="plotly_dark", height=400
@@ -195,10 +406,10 @@ def main():
     # Peer Comparisons
     with tab4:
         st.subheader("Peers by Sectors")
-        industry_peers = df[(df["industry"] == latest["industry"]) & (df["Company_symbol"] != company)]
-        peers_df = industry_peers.groupby("Company_symbol").apply(
-            lambda x: x.loc[x['quarter_date'].idxmax()]
-        ).reset_index(drop=True)
+        latest_quarter_df = latest_per_company(df, data_version)
+        industry_rows = industry_index(df, data_version).get(latest_industry, [])
+        industry_latest = latest_quarter_df.iloc[industry_rows]
+        peers_df = industry_latest[industry_latest["Company_symbol"] != company]
         peers_df = peers_df.sort_values("InstitutionPercentHeld", ascending=False).head(10)
         st.dataframe(peers_df[[
             "Company_symbol", "Company_name", "InstitutionPercentHeld",
@@ -207,7 +418,6 @@ def main():
         ]])
 
         st.subheader("Top 10 Companies by Institution % Held (Latest Quarter)")
-        latest_quarter_df = df.loc[df.groupby("Company_symbol")["quarter_date"].idxmax()]
         top10_df = latest_quarter_df.sort_values("InstitutionPercentHeld", ascending=False).head(10)
         st.dataframe(top10_df[[
             "Company_symbol", "Company_name", "InstitutionPercentHeld",
@@ -220,10 +430,14 @@ def main():
     # -------------------------------
     st.sidebar.markdown("---")
     st.sidebar.subheader("⬇ Download Data")
-    output_file = "processed_ownership_data.xlsx"
-    df.to_excel(output_file, index=False)
-    with open(output_file, "rb") as f:
-        st.sidebar.download_button("Download Excel", f, file_name=output_file, mime="application/vnd.ms-excel")
+    st.sidebar.download_button(
+        "Download CSV", build_download_bytes(df, data_version, "csv"),
+        file_name="processed_ownership_data.csv", mime="text/csv"
+    )
+    st.sidebar.download_button(
+        "Download Parquet", build_download_bytes(df, data_version, "parquet"),
+        file_name="processed_ownership_data.parquet", mime="application/vnd.apache.parquet"
+    )
 
 
 # -------------------------------